@@ -1,3 +1,3 @@
 from base import corr2_coef, parallel_corr2_coef, unit_vector, down_sample, time_lag_corr, img_resize, r2p, make_2d_gaussian, make_cycle, make_2d_dog, make_2d_log
-from lm import ols_fit, LinearRegression
+from lm import ols_fit, ols_fit_batch, LinearRegression
 from pls import get_pls_components, pls_regression_predict
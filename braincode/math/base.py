@@ -1,76 +1,135 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+from __future__ import print_function
+import os
+import warnings
 import numpy as np
-from scipy import stats
+from scipy import special
+from scipy.signal import fftconvolve
 from skimage.measure import block_reduce
 from skimage.transform import resize
-from joblib import Parallel, delayed
 
-def corr2_coef(A, B, mode='full'):
+def corr2_coef(A, B, mode='full', dtype=np.float32):
     """Row-wise Correlation Coefficient calculation for two 2D arrays.
     Input 2D array A (m by d), array B (n by d), in `full` model, the function
     would return a correlation matrix (m by n); in `pair` model, array A and
     B must have identical shape (m == n), and a correlation array for each
     pair of vector would be returned.
+    `dtype` only applies to `full` mode, in which the inputs are cast to it
+    before the matrix product. `pair` mode ignores it and always works in
+    float64, since r is computed from raw sums which lose precision in
+    float32.
 
     """
     if mode=='full':
+        A = np.ascontiguousarray(A, dtype=dtype)
+        B = np.ascontiguousarray(B, dtype=dtype)
         # Row-wise mean of input arrays & subtract from input arrays themselves
         A_mA = A - A.mean(1)[:, None]
         B_mB = B - B.mean(1)[:, None]
-        # Sum of squares across rows
-        ssA = (A_mA**2).sum(1)
-        ssB = (B_mB**2).sum(1)
-        # Finally get corr coef
-        return np.dot(A_mA, B_mB.T)/np.sqrt(np.dot(ssA[:, None], ssB[None]))
+        # Scale each row to unit length in place, the sum of squares across
+        # rows is computed by einsum without a squared temporary
+        A_mA /= np.sqrt(np.einsum('ij, ij->i', A_mA, A_mA))[:, None]
+        B_mB /= np.sqrt(np.einsum('ij, ij->i', B_mB, B_mB))[:, None]
+        # Finally get corr coef in a single matrix product
+        return np.dot(A_mA, B_mB.T)
     elif mode=='pair':
-        norm_A = (A - A.mean(1)[:, None]) / A.std(1)[:, None]
-        norm_B = (B - B.mean(1)[:, None]) / B.std(1)[:, None]
-        norm_A = np.nan_to_num(norm_A)
-        norm_B = np.nan_to_num(norm_B)
-        return np.einsum('ij, ij->i', norm_A, norm_B)/A.shape[1]
-
-def parallel_corr2_coef(A, B, filename, block_size=32, n_jobs=8):
-    """Compute row-wise correlation coefficient for two 2D arrays in a
-    parallel computing approach.
+        # Pearson's r from sums over mean-centered rows, without making
+        # scaled copies; centering first keeps the sums accurate when the
+        # mean is large compared to the spread
+        A = np.asarray(A, dtype=np.float64)
+        B = np.asarray(B, dtype=np.float64)
+        A = A - A.mean(1)[:, None]
+        B = B - B.mean(1)[:, None]
+        num = np.einsum('ij, ij->i', A, B)
+        den = np.sqrt(np.einsum('ij, ij->i', A, A) *
+                      np.einsum('ij, ij->i', B, B))
+        # rows with zero variance get a correlation of 0
+        return np.nan_to_num(num / np.where(den==0, np.inf, den), copy=False)
+
+def norm_rows(A):
+    """Mean-center each row of the 2D array `A` and scale it to unit length,
+    so that the dot product of two normalized rows is their Pearson's r.
+    """
+    A = np.asarray(A, dtype=np.float32)
+    A_mA = A - A.mean(1, keepdims=True)
+    return A_mA / np.sqrt((A_mA**2).sum(1, keepdims=True))
+
+def l3_block_size(row_len, itemsize=4):
+    """Return the number of rows of `row_len` items (each `itemsize` bytes)
+    which fit in half of the L3 cache. 8 MB L3 cache is assumed if the size
+    could not be detected.
+    """
+    try:
+        l3_size = os.sysconf('SC_LEVEL3_CACHE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        l3_size = 0
+    if l3_size <= 0:
+        l3_size = 8*1024*1024
+    return max(1, l3_size // (row_len*itemsize) // 2)
+
+def parallel_corr2_coef(A, B, filename, block_size=None, n_jobs=None,
+                        dtype='float32'):
+    """Compute row-wise correlation coefficient for two 2D arrays block by
+    block.
     Array `B` would be divided into several blocks each containing
-    `block_size` rows for one parallel computing iteration.
+    `block_size` rows. Each block is correlated with all rows of `A` in one
+    BLAS matrix product (GEMM), and written into an .npy memmap. The
+    parallelism comes from the multithreaded BLAS library rather than from
+    parallel jobs.
     
     Usage
     -----
-    cross_modal_corr(A, B, filename, block_size=32, n_jobs=8)
+    parallel_corr2_coef(A, B, filename, block_size=None, n_jobs=None,
+                        dtype='float32')
     
     Return
     ------
-    A row-wise correlation matrix saved in `filename`. For example, if
-    the size of `A` is (p, n), and the size of `B` is (q, n), the
-    size of return matrix is (p, q).
+    A row-wise correlation matrix saved in `filename` in .npy format. For
+    example, if the size of `A` is (p, n), and the size of `B` is (q, n),
+    the size of return matrix is (p, q).
 
     Note
     ----
-    'block_size' : the number of rows in `B` processed in one iter.
+    'block_size' : the number of rows in `B` processed in one iter. If None,
+                   it is set as the number of rows of `B` which fit in half
+                   of the L3 cache.
+    'n_jobs' : deprecated and ignored, kept for backward compatibility.
+    'dtype' : data type of the saved matrix. float32 is recommended. `int8`
+              is an opt-in lossy format, r is quantized with a fixed scale
+              of 127, i.e. r = value / 127.0, which is coarse enough to
+              change the top-n pixels picked in retinotopic mapping.
+    The number of BLAS threads could be set with `OMP_NUM_THREADS` (or the
+    MKL/OpenBLAS equivalent).
     """
+    if n_jobs is not None:
+        warnings.warn('n_jobs is deprecated and ignored, set the number of '
+                      'BLAS threads instead', DeprecationWarning)
     # to reduce memory usage, we compute Pearson's r iteratively
     A_size = A.shape[0]
     B_size = B.shape[0]
-    corr_mtx = np.memmap(filename, dtype='float16', mode='w+',
-                         shape=(A_size, B_size))
-    print 'Compute row-wise correlation ...'
-    # parallelize the corr computation
-    Parallel(n_jobs=n_jobs)(delayed(pcorr2_sugar)(A, B, corr_mtx, i,
-                            block_size) for i in range(B_size/block_size))
-    narray = np.nan_to_num(np.array(corr_mtx))
-    np.save(filename, narray)
-
-def pcorr2_sugar(A, B, output, i, block_size):
-    """Sugar function for parallel computing."""
-    print 'Iter %s' %(i)
-    if (i+1)*block_size > B.shape[0]:
-        output[:, i*block_size:] = corr2_coef(A, B[i*block_size:, :])
-    else:
-        output[:, i*block_size:(i+1)*block_size] = corr2_coef(A,
-                    B[i*block_size:(i+1)*block_size, :])
+    if not block_size:
+        block_size = l3_block_size(B.shape[1])
+    # blocks are written into a .npy memmap directly, so the matrix needs
+    # not be loaded back into memory for saving
+    corr_mtx = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                         shape=(A_size, B_size))
+    print('Compute row-wise correlation ...')
+    # rows of `A` are normalized only once, and each block of `B` is
+    # correlated with all of them in a single matrix product
+    norm_A = np.ascontiguousarray(norm_rows(A))
+    for i in range(0, B_size, block_size):
+        pcorr2_sugar(norm_A, B, corr_mtx, i, block_size)
+    corr_mtx.flush()
+
+def pcorr2_sugar(norm_A, B, output, i, block_size):
+    """Sugar function for block computing."""
+    norm_B = np.ascontiguousarray(norm_rows(B[i:i+block_size, :]))
+    corr = np.nan_to_num(np.dot(norm_A, norm_B.T), copy=False)
+    if output.dtype == np.int8:
+        corr = np.clip(np.rint(corr*127), -127, 127)
+    output[:, i:i+block_size] = corr
 
 def unit_vector(vector):
     """Return the unit vector of the input."""
@@ -96,11 +155,8 @@ def img_resize(img, out_dim):
     img is a 3d array which first 2 dim corresponding image size
     out_dim is a tuple containing resized image size
     """
-    im_min, im_max = img.min(), img.max()
-    im_std = (img - im_min) / (im_max - im_min)
-    resized_im = resize(im_std, out_dim, order=1)
-    resized_im = resized_im * (im_max - im_min) + im_min
-    return resized_im
+    # keep the original value range instead of rescaling the image to [0, 1]
+    return resize(img, out_dim, order=1, preserve_range=True)
 
 def time_lag_corr(x, y, maxlag):
     """Calculate cross-correlation between x and a lagged y.
@@ -112,12 +168,12 @@ def time_lag_corr(x, y, maxlag):
     k : 0 ~ (maxlag-1)
 
     """
-    c = np.zeros(maxlag)
-    y = np.array(y)
-    for i in range(maxlag):
-        lagy = np.array(y[i:].tolist()+[0]*i)
-        c[i] = np.correlate(x, lagy) / len(x)
-    return c
+    # c[k] is the full convolution of y and the reversed x at len(x)-1+k,
+    # so all lags are computed with a single FFT
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    c = fftconvolve(y, x[::-1], mode='full')
+    return c[(len(x)-1):(len(x)-1+maxlag)] / len(x)
 
 def r2p(r, sample_size, two_side=True):
     """Calculate p value from correlation coefficient r.
@@ -125,19 +181,28 @@ def r2p(r, sample_size, two_side=True):
     """
     tt = r / np.sqrt((1-np.square(r))/(sample_size-2))
     if two_side:
-        return stats.t.sf(np.abs(tt), sample_size-2)*2
+        return special.stdtr(sample_size-2, -1*np.abs(tt))*2
     else:
-        return stats.t.sf(tt, sample_size-2)
+        return special.stdtr(sample_size-2, -1*tt)
+
+def sep_gaussian(x, y, x0, y0, sigma):
+    """Sugar function for an unnormalized 2D gaussian, computed as the outer
+    product of two 1D gaussians along the column `x` and the row `y`.
+    """
+    gx = np.exp(-0.5*(x-x0)**2/sigma**2)
+    gy = np.exp(-0.5*(y-y0)**2/sigma**2)
+    return gy*gx
 
-def make_2d_gaussian(size, sigma, center=None):
+def make_2d_gaussian(size, sigma, center=None, dtype=np.float32):
     """Make a square gaussian kernel.
 
     `size` is the length of a side of the square;
     `sigma` is standard deviation of the 2D gaussian;
     `center` is the center of the gaussian curve, None: default in center of
     the square, a cell of (x0, y0) for a specific location; x0 - col, y0 - row.
+    `dtype` is the data type of the kernel.
     """
-    x = np.arange(0, size, 1, float)
+    x = np.arange(0, size, 1, dtype)
     y = x[:, np.newaxis]
 
     if center is None:
@@ -146,9 +211,10 @@ def make_2d_gaussian(size, sigma, center=None):
         x0 = center[0]
         y0 = center[1]
 
-    return np.exp(-0.5*((x-x0)**2+(y-y0)**2)/sigma**2)/(2*np.pi*sigma**2)
+    return sep_gaussian(x, y, x0, y0, sigma)/(2*np.pi*sigma**2)
 
-def make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=None):
+def make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=None,
+                dtype=np.float32):
     """Make a square difference of gaussian (DoG) kernel.
 
     `size` is the length of a side of the square;
@@ -158,8 +224,9 @@ def make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=None):
     `s_beta` is weight of the `surround` gaussian;
     `center` is the center of the gaussian curve, None: default in center of
     the square, a cell of (x0, y0) for a specific location; x0 - col, y0 - row.
+    `dtype` is the data type of the kernel.
     """
-    x = np.arange(0, size, 1, float)
+    x = np.arange(0, size, 1, dtype)
     y = x[:, np.newaxis]
 
     if center is None:
@@ -168,11 +235,12 @@ def make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=None):
         x0 = center[0]
         y0 = center[1]
 
-    cg = np.exp(-0.5*((x-x0)**2+(y-y0)**2)/c_sigma**2)/(2*np.pi*c_sigma**2)
-    sg = np.exp(-0.5*((x-x0)**2+(y-y0)**2)/s_sigma**2)/(2*np.pi*s_sigma**2)
+    cg = sep_gaussian(x, y, x0, y0, c_sigma)/(2*np.pi*c_sigma**2)
+    sg = sep_gaussian(x, y, x0, y0, s_sigma)/(2*np.pi*s_sigma**2)
     return c_beta*cg - s_beta*sg
 
-def make_2d_log(size, sigma, center=None):
+def make_2d_log(size, sigma, center=None, approx='exact',
+                dtype=np.float32):
     """Make a square Laplacian of Gaussian (LoG) kernel.
 
     `size` is the length of a side of the square;
@@ -180,8 +248,22 @@ def make_2d_log(size, sigma, center=None):
         the radius;
     `center` is the center of the gaussian curve, None: default in center of
     the square, a cell of (x0, y0) for a specific location; x0 - col, y0 - row.
+    `approx` is 'exact' for the LoG formula, or 'dog' for a DoG approximation
+    whose center and surround sigma are sigma/sqrt(k) and sigma*sqrt(k), with
+    a ratio of k = 1.6.
+    `dtype` is the data type of the kernel.
+
+    Note: G_{sigma*sqrt(k)} - G_{sigma/sqrt(k)} ~ (k-1)/sqrt(k)*sigma^2*LoG,
+    where G is the normalized gaussian, so the DoG is weighted by
+    pi*sqrt(k)/(2*(k-1)) to match the scale of the exact kernel.
     """
-    x = np.arange(0, size, 1, float)
+    if approx=='dog':
+        k = 1.6
+        beta = np.pi*k**0.5 / (2*(k-1))
+        return make_2d_dog(size, sigma/k**0.5, sigma*k**0.5,
+                           beta, beta, center, dtype)
+
+    x = np.arange(0, size, 1, dtype)
     y = x[:, np.newaxis]
 
     if center is None:
@@ -190,17 +272,19 @@ def make_2d_log(size, sigma, center=None):
         x0 = center[0]
         y0 = center[1]
 
-    return -1*np.exp(-0.5*((x-x0)**2+(y-y0)**2)/sigma**2)*((x-x0)**2+(y-y0)**2-2*sigma**2)/(4*sigma**4)
+    r2 = (x-x0)**2+(y-y0)**2
+    return -1*sep_gaussian(x, y, x0, y0, sigma)*(r2-2*sigma**2)/(4*sigma**4)
 
-def make_cycle(size, radius, center=None):
+def make_cycle(size, radius, center=None, dtype=np.float32):
     """Make a 2d cycle.
     `size` is the length of a side of the square;
     `radius` is radius of the 2D cycle;
     `center` is the center of the cycle, None: default in center of
     the square, a cell of (x0, y0) for a specific location; x0 - col, y0 - row.
+    `dtype` is the data type of the kernel.
     """
     
-    x = np.arange(0, size, 1, float)
+    x = np.arange(0, size, 1, dtype)
     y = x[:, np.newaxis]
 
     if center is None:
@@ -209,8 +293,10 @@ def make_cycle(size, radius, center=None):
         x0 = center[0]
         y0 = center[1]
 
-    r = np.sqrt((x-x0)**2+(y-y0)**2)
-    m = np.zeros((size, size))
-    m[r<=radius] = 1
+    # compare squared distance against squared radius, no sqrt needed, and
+    # write the result into the output array in one pass
+    r2 = (x-x0)**2+(y-y0)**2
+    m = np.empty((size, size), dtype=dtype)
+    np.less_equal(r2, radius**2, out=m)
     return m
 
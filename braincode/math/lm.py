@@ -4,7 +4,8 @@
 import numpy as np
 import statsmodels.api as sm
 from sklearn import linear_model
-from scipy import stats
+from scipy import linalg
+from scipy import special
 
 
 def ols_fit(y, x):
@@ -13,6 +14,21 @@ def ols_fit(y, x):
     res = sm.OLS(y, x).fit()
     return res.rsquared
 
+def ols_fit_batch(Y, x):
+    """Return the R-squared values of the OLS fitted models for each column
+    of `Y` (n by n_targets) with the same regressors `x`.
+    The pseudo-inverse of `x` is computed once and shared by all targets,
+    as statsmodels does for a single target in `ols_fit`, so rank-deficient
+    designs (e.g. zero or duplicated columns) give the same results.
+    """
+    x = sm.add_constant(x)
+    Y = np.asarray(Y, dtype=np.float64)
+    beta = np.dot(np.linalg.pinv(x), Y)
+    resid = Y - np.dot(x, beta)
+    ssr = (resid**2).sum(axis=0)
+    sst = ((Y - Y.mean(axis=0))**2).sum(axis=0)
+    return 1 - ssr/sst
+
 class LinearRegression(linear_model.LinearRegression):
     """
     LinearRegression class after sklearn's, but calculate t-statistics
@@ -31,15 +47,18 @@ class LinearRegression(linear_model.LinearRegression):
     def fit(self, X, y, n_jobs=1):
         self = super(LinearRegression, self).fit(X, y, n_jobs)
         
-        sse = np.sum((self.predict(X)-y)**2,axis=0)/float(X.shape[0]-X.shape[1])
-        if not sse.shape:
-            sse = np.array([sse])
-        se = np.array([
-            np.sqrt(np.diagonal(sse[i]*np.linalg.inv(np.dot(X.T, X))))
-                                    for i in range(sse.shape[0])
-                    ])
+        # residuals from the fitted coefficients, one column per target
+        resid = np.dot(X, self.coef_.T) + self.intercept_ - y
+        resid = resid.reshape(X.shape[0], -1)
+        sse = np.einsum('ij, ij->j', resid, resid)/float(X.shape[0]-X.shape[1])
+        # the diagonal of inv(X'X) is shared by all targets, it is derived
+        # from the Cholesky factor X'X = LL' as the column sums of inv(L)**2
+        L = linalg.cholesky(np.dot(X.T, X), lower=True)
+        Z = linalg.solve_triangular(L, np.eye(X.shape[1]), lower=True)
+        xtx_inv_diag = (Z**2).sum(axis=0)
+        se = np.sqrt(sse[:, None] * xtx_inv_diag[None, :])
         self.t = self.coef_ / se
-        self.p = 2 * (1-stats.t.cdf(np.abs(self.t), y.shape[0]-X.shape[1]))
+        self.p = 2 * special.stdtr(y.shape[0]-X.shape[1], -1*np.abs(self.t))
         return self
 
 
@@ -0,0 +1,43 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+from numpy.testing import assert_allclose
+from skimage.transform import resize
+
+from braincode.math.base import corr2_coef, img_resize
+
+
+def _img_resize_orig(img, out_dim):
+    """Resize by rescaling the image into [0, 1], the previous approach."""
+    im_min, im_max = img.min(), img.max()
+    im_std = (img - im_min) / (im_max - im_min)
+    resized_im = resize(im_std, out_dim, order=1)
+    return resized_im * (im_max - im_min) + im_min
+
+def test_img_resize():
+    """Same output as the previous min-max rescaling approach."""
+    rng = np.random.RandomState(0)
+    img = rng.rand(27, 27, 10) * 4 - 1
+    for out_dim in [(55, 55), (13, 13)]:
+        out = img_resize(img, out_dim)
+        assert out.shape == out_dim + (10, )
+        assert_allclose(out, _img_resize_orig(img, out_dim), atol=1e-10)
+
+def test_img_resize_float16():
+    """float16 input is accepted."""
+    rng = np.random.RandomState(0)
+    img = rng.rand(27, 27, 4).astype(np.float16)
+    out = img_resize(img, (55, 55))
+    assert out.shape == (55, 55, 4)
+    assert_allclose(out, _img_resize_orig(img, (55, 55)), atol=1e-2)
+
+def test_corr2_coef_pair_large_mean():
+    """Pair mode stays accurate for rows with a large mean."""
+    rng = np.random.RandomState(0)
+    A = rng.randn(5, 200) + 1e7
+    B = A + rng.randn(5, 200)
+    r = corr2_coef(A, B, mode='pair')
+    expected = [np.corrcoef(a, b)[0, 1] for a, b in zip(A, B)]
+    assert_allclose(r, expected, rtol=1e-8)
+    assert_allclose(corr2_coef(np.ones((1, 10)), B[:1, :10], mode='pair'), 0)
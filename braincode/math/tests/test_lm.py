@@ -0,0 +1,26 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from braincode.math.lm import ols_fit, ols_fit_batch
+
+
+def test_ols_fit_batch():
+    """Same R-squared as `ols_fit` for each target."""
+    rng = np.random.RandomState(0)
+    x = rng.randn(100, 5)
+    Y = np.dot(x, rng.randn(5, 8)) + rng.randn(100, 8)
+    r2 = [ols_fit(Y[:, i], x) for i in range(Y.shape[1])]
+    assert_allclose(ols_fit_batch(Y, x), r2, rtol=1e-10)
+
+def test_ols_fit_batch_rank_deficient():
+    """A zero column and a duplicated column do not inflate R-squared."""
+    rng = np.random.RandomState(0)
+    x = rng.randn(100, 5)
+    x[:, 1] = 0
+    x[:, 3] = x[:, 2]
+    Y = np.dot(x, rng.randn(5, 8)) + rng.randn(100, 8)
+    r2 = [ols_fit(Y[:, i], x) for i in range(Y.shape[1])]
+    assert_allclose(ols_fit_batch(Y, x), r2, rtol=1e-10)
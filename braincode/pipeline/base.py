@@ -4,7 +4,7 @@
 import os
 import numpy as np
 from joblib import Parallel, delayed
-from braincode.math import corr2_coef, ols_fit, ridge
+from braincode.math import corr2_coef, ols_fit_batch, ridge
 
 
 def random_cross_modal_corr(fmri_ts, feat_ts, voxel_num, iter_num, filename):
@@ -36,22 +36,22 @@ def multiple_regression(fmri_ts, feat_ts, filename):
     reg_mtx = np.memmap(filename, dtype='float16', mode='w+',
                         shape=(fmri_size, feat_size[1], feat_size[2]))
     print 'Compute multiple regression correlation ...'
-    Parallel(n_jobs=4)(delayed(mrf)(fmri_ts, feat_ts, reg_mtx, v)
-                                    for v in range(fmri_size))
+    Parallel(n_jobs=4)(delayed(mrf)(fmri_ts, feat_ts, reg_mtx, i)
+                                    for i in range(feat_size[1]))
     
     narray = np.array(reg_mtx)
     np.save(filename, narray)
 
-def mrf(in_fmri, in_feat, out, idx):
-    """Sugar function for multiple regression."""
-    print idx
-    y = in_fmri[idx, :]
-    feat_size = in_feat.shape
-    for i in range(feat_size[1]):
-        for j in range(feat_size[2]):
-            #print '%s-%s-%s' %(idx, i, j)
-            x = in_feat[:, i, j, :].T
-            out[idx, i, j] = ols_fit(y, x)
+def mrf(in_fmri, in_feat, out, row):
+    """Sugar function for multiple regression.
+    All voxels are fitted at once with the channels from each location in
+    the `row`.
+    """
+    print row
+    Y = np.asarray(in_fmri).T
+    for j in range(in_feat.shape[2]):
+        x = in_feat[:, row, j, :].T
+        out[:, row, j] = ols_fit_batch(Y, x)
 
 def ridge_regression(train_feat, train_fmri, val_feat, val_fmri,
                      out_dir, prefix, with_wt=True, n_cpus=4):
@@ -36,9 +36,9 @@ def load_vim2_fmri(db_dir, subj_id, roi=None):
     # load fmri response
     # data shape: (#voxel, 7200/540)
     train_ts = tf.get_node('/rt')[:]
-    train_ts = np.nan_to_num(train_ts[vxl_idx])
+    train_ts = np.nan_to_num(train_ts[vxl_idx], copy=False)
     val_ts = tf.get_node('/rv')[:]
-    val_ts = np.nan_to_num(val_ts[vxl_idx])
+    val_ts = np.nan_to_num(val_ts[vxl_idx], copy=False)
     tf.close()
     return vxl_idx, train_ts, val_ts
 
@@ -64,10 +64,10 @@ def load_vim1_fmri(db_dir, subj_id, roi=None):
         vxl_idx = non_nan_idx
     # load fmri response
     # data shape: (#voxel, 1750/120)
-    train_ts = np.nan_to_num(train_ts[vxl_idx])
+    train_ts = np.nan_to_num(train_ts[vxl_idx], copy=False)
     val_ts = tf.get_node('/dataValS%s'%(subj_id))[:]
     val_ts = val_ts.T
-    val_ts = np.nan_to_num(val_ts[vxl_idx])
+    val_ts = np.nan_to_num(val_ts[vxl_idx], copy=False)
     tf.close()
     return vxl_idx, train_ts, val_ts
 
@@ -75,7 +75,8 @@ def get_vxl_coding_wts(feat_dir, prf_dir, roi):
             sigma = [1] + [n*5 for n in range(1, 13)] + [70, 80, 90, 100]
             s = sigma[si]
             print 'center: %s, %s, sigma: %s'%(y0, x0, s)
-            kernel = make_2d_gaussian(500, s, center=(x0, y0))
+            kernel = make_2d_gaussian(500, s, center=(x0, y0),
+                                      dtype=np.float64)
             kernel = np.expand_dims(kernel, 0)
             kernel = np.repeat(kernel, 72, 0)
             coding_wts = sel_paras[tmp_idx[i]]
@@ -332,20 +332,6 @@ def get_roi_mask(fmri_table, nifti=False):
     else:
         return mask.flatten()
 
-def gen_mean_vol(fmri_table, dataset, filename):
-    """Make a mean response map as a reference volume."""
-    data = fmri_table.get_node('/'+dataset)[:]
-    # replace nan to zero
-    data = np.nan_to_num(data)
-    mean_data = np.mean(data, axis=1)
-    vol = np.zeros((18, 64, 64))
-    
-    for i in range(data.shape[0]):
-        c = vutil.idx2coord(i)
-        vol[c[0], c[1], c[2]] = mean_data[i]
-    
-    save2nifti(vol, filename)
-
 def spatial_sim_seq(fmri_data):
     """Calculate spatial similarity between adjacent time points.
     fmri_data : A 2D array, each row represents a voxel's time course. 
@@ -378,18 +364,19 @@ def make_gaussian_prf(size):
 
 def sugar_gaussian_f(size, x0, y0, sigma, offset, beta):
     """Sugar function for model fitting."""
-    g = make_2d_gaussian(size, sigma, center=(y0, x0))
+    g = make_2d_gaussian(size, sigma, center=(y0, x0), dtype=np.float64)
     g = offset + beta * g
     return g.ravel()
 
 def sugar_dog_f(size, x0, y0, c_sigma, s_sigma, c_beta, s_beta):
     """Sugar function for model fitting."""
-    g = make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=(y0, x0))
+    g = make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=(y0, x0),
+                    dtype=np.float64)
     return g.ravel()
 
 def sugar_log_f(size, x0, y0, sigma, offset, beta):
     """Sugar function for model fitting."""
-    g = make_2d_log(size, sigma, center=(y0, x0))
+    g = make_2d_log(size, sigma, center=(y0, x0), dtype=np.float64)
     g = offset + beta * g
     return g.ravel()
 
@@ -127,7 +127,8 @@ def model_pro(feat, cand_model, xi, yi, si):
     y0 = center_y[yi]
     s = sigma[si]
     print 'Model %s : center - (%s, %s), sigma %s'%(mi, y0, x0, s)
-    kernel = make_2d_gaussian(500, s, center=(x0, y0))
+    kernel = make_2d_gaussian(500, s, center=(x0, y0),
+                              dtype=np.float64)
     kernel = kernel.flatten()
     idx_head = 0
     parts = feat.shape[0] / 10
@@ -339,7 +340,8 @@ def prf_recon(prf_dir, db_dir, subj_id, roi):
         y0 = np.arange(5, 500, 10)[yi]
         sigma = [1] + [n*5 for n in range(1, 13)] + [70, 80, 90, 100]
         s = sigma[si]
-        kernel = make_2d_gaussian(500, s, center=(x0, y0))
+        kernel = make_2d_gaussian(500, s, center=(x0, y0),
+                                  dtype=np.float64)
         kpos = np.nonzero(kernel)
         paras = sel_paras[i]
         for f in range(9):
@@ -347,7 +349,8 @@ def prf_recon(prf_dir, db_dir, subj_id, roi):
             fs = np.sqrt(2)**f*4
             for p in range(kpos[0].shape[0]):
                 tmp = make_2d_gaussian(500, fs, center=(kpos[1][p],
-                                                        kpos[0][p]))
+                                                        kpos[0][p]),
+                                       dtype=np.float64)
                 prfs[i] += fwt * kernel[kpos[0][p], kpos[1][p]] * tmp
         if sel_model_corr[i]>=0.24:
             prf_file = os.path.join(fig_dir,'Voxel_%s_%s.png'%(i+1, vxl_idx[i]))
@@ -395,7 +398,8 @@ def filter_recon(prf_dir, db_dir, subj_id, roi):
         sigma = [1] + [n*5 for n in range(1, 13)] + [70, 80, 90, 100]
         s = sigma[si]
         print 'center: %s, %s, sigma: %s'%(y0, x0, s)
-        kernel = make_2d_gaussian(500, s, center=(x0, y0))
+        kernel = make_2d_gaussian(500, s, center=(x0, y0),
+                                  dtype=np.float64)
         kpos = np.nonzero(kernel>0.00000001)
         paras = sel_paras[i]
         tmp_file = os.path.join(fig_dir, 'tmp_kernel.npy')
@@ -40,31 +40,28 @@ def retinotopic_mapping(corr_file, data_dir, vxl_idx=None, figout=False):
     pos_mtx = np.zeros((73728, 2))
     pos_mtx[:] = np.nan
     for i in range(len(vxl_idx)):
-        print 'Iter %s of %s' %(i+1, len(vxl_idx)),
-        tmp = corr_mtx[i, :]
-        tmp = np.nan_to_num(np.array(tmp))
+        if not i % 1024:
+            print 'Iter %s of %s' %(i+1, len(vxl_idx))
+        # single explicit conversion of the float16 row to float32
+        tmp = np.nan_to_num(np.asarray(corr_mtx[i, :], dtype=np.float32))
         # significant threshold for one-tail test
         tmp[tmp <= 0.019257] = 0
         if np.sum(tmp):
             mmtx = tmp.reshape(55, 55)
             #tmp = tmp.reshape(96, 27, 27)
             #mmtx = np.max(tmp, axis=0)
-            print mmtx.min(), mmtx.max()
             if figout:
                 fig_file = os.path.join(fig_dir, 'v'+str(vxl_idx[i])+'.png')
                 imsave(fig_file, mmtx)
             # get indices of n maximum values
             max_n = 20
-            row_idx, col_idx = np.unravel_index(
-                                        np.argsort(mmtx.ravel())[-1*max_n:],
-                                        mmtx.shape)
+            top_idx = np.argpartition(mmtx.ravel(), -1*max_n)[-1*max_n:]
+            row_idx, col_idx = np.unravel_index(top_idx, mmtx.shape)
             nmtx = np.zeros(mmtx.shape)
             nmtx[row_idx, col_idx] = mmtx[row_idx, col_idx]
             # center of mass
             x, y = ndimage.measurements.center_of_mass(nmtx)
             pos_mtx[vxl_idx[i], :] = [x, y]
-        else:
-            print ' '
     #receptive_field_file = os.path.join(data_dir, 'receptive_field_pos.npy')
     #np.save(receptive_field_file, pos_mtx)
     #pos_mtx = np.load(receptive_field_file)
@@ -136,7 +133,6 @@ def plscorr_eval(train_fmri_ts, train_feat_ts, val_fmri_ts, val_feat_ts,
     plsca.fit(train_feat_ts, train_fmri_ts)
     from sklearn.externals import joblib
     joblib.dump(plsca, os.path.join(out_dir, 'plsca_model.pkl'))
-    plsca = joblib.load(os.path.join(out_dir, 'plsca_model.pkl'))
 
     # calculate correlation coefficient between truth and prediction
     pred_fmri_ts = plsca.predict(val_feat_ts)
@@ -178,9 +178,11 @@ def model_pro(train_in, val_in, train_out, val_out, kernel, xi, yi, si):
     s = sigma[si]
     print 'Model %s : center - (%s, %s), sigma %s'%(mi, x0, y0, s)
     if kernel == 'gaussian':
-        kernel = make_2d_gaussian(128, s, center=(x0, y0))
+        kernel = make_2d_gaussian(128, s, center=(x0, y0),
+                                  dtype=np.float64)
     else:
-        kernel = 0.01 * make_cycle(128, s, center=(x0, y0))
+        kernel = 0.01 * make_cycle(128, s, center=(x0, y0),
+                                   dtype=np.float64)
     kernel = kernel.flatten()
     tmp = np.zeros((331200, ), dtype=np.float16)
     for i in range(23):
@@ -437,7 +439,8 @@ def prf_recon(prf_dir, db_dir, subj_id, roi):
         y0 = np.arange(0, 128, 4)[yi]
         s = np.linspace(1, 50, 15)[si]
         #kernel = make_cycle(128, s, center=(x0, y0))
-        kernel = make_2d_gaussian(128, s, center=(x0, y0))
+        kernel = make_2d_gaussian(128, s, center=(x0, y0),
+                                  dtype=np.float64)
         kpos = np.nonzero(kernel)
         paras = sel_paras[i]
         for f in range(5):
@@ -445,7 +448,8 @@ def prf_recon(prf_dir, db_dir, subj_id, roi):
             fs = np.sqrt(2)**f*4
             for p in range(kpos[0].shape[0]):
                 tmp = make_2d_gaussian(128, fs, center=(kpos[1][p],
-                                                        kpos[0][p]))
+                                                        kpos[0][p]),
+                                       dtype=np.float64)
                 prfs[i] += fwt * kernel[kpos[0][p], kpos[1][p]] * tmp
         if sel_model_corr[i]>=0.25:
             prf_file = os.path.join(fig_dir,'Voxel_%s_%s.png'%(i+1, vxl_idx[i]))
@@ -491,7 +495,8 @@ def filter_recon(prf_dir, db_dir, subj_id, roi):
         x0 = np.arange(0, 128, 4)[xi]
         y0 = np.arange(0, 128, 4)[yi]
         s = np.linspace(1, 50, 15)[si]
-        kernel = make_2d_gaussian(128, s, center=(x0, y0))
+        kernel = make_2d_gaussian(128, s, center=(x0, y0),
+                                  dtype=np.float64)
         kpos = np.nonzero(kernel)
         paras = sel_paras[i]
         for gwt_idx in range(40):
@@ -6,10 +6,12 @@ import numpy as np
 import tables
 from scipy import ndimage
 from scipy.misc import imsave
+from scipy.signal import fftconvolve
+from numba import njit, prange
 from sklearn.cross_decomposition import PLSCanonical
 
 from braincode.util import configParser
-from braincode.math import parallel_corr2_coef, corr2_coef, ridge
+from braincode.math import corr2_coef, ridge
 from braincode.math import get_pls_components, rcca
 from braincode.math.norm import zero_one_norm
 from braincode.pipeline import retinotopy
@@ -26,8 +28,93 @@ def check_path(dir_path):
     if not os.path.exists(dir_path):
         os.mkdir(dir_path, 0755)
 
+@njit(parallel=True)
+def _retino_kernel(corr_mtx, thresh, chnl_num, top_idx, top_val):
+    """Find the most correlated pixels of each voxel.
+    Each row of `corr_mtx` is a (channel x pixel) correlation map in float32
+    or quantized int8, values not larger than `thresh` are ignored and the
+    max across channels is taken for each pixel. Linear pixel indexes and
+    values of the top `top_idx.shape[1]` pixels are saved in `top_idx` and
+    `top_val`, empty slots are left with an index of -1 and a value of 0.
+    """
+    pixel_num = corr_mtx.shape[1] // chnl_num
+    max_n = top_idx.shape[1]
+    for i in prange(corr_mtx.shape[0]):
+        # max across channels
+        mmtx = np.zeros(pixel_num, dtype=np.float32)
+        for c in range(chnl_num):
+            for p in range(pixel_num):
+                v = corr_mtx[i, c*pixel_num+p]
+                if v > thresh and v > mmtx[p]:
+                    mmtx[p] = v
+        # keep n maximum values in a min-heap
+        heap_v = np.zeros(max_n, dtype=np.float32)
+        heap_i = np.zeros(max_n, dtype=np.int64) - 1
+        for p in range(pixel_num):
+            if mmtx[p] > heap_v[0]:
+                heap_v[0] = mmtx[p]
+                heap_i[0] = p
+                j = 0
+                while 2*j+1 < max_n:
+                    m = 2*j + 1
+                    if m+1 < max_n and heap_v[m+1] < heap_v[m]:
+                        m += 1
+                    if heap_v[m] >= heap_v[j]:
+                        break
+                    heap_v[j], heap_v[m] = heap_v[m], heap_v[j]
+                    heap_i[j], heap_i[m] = heap_i[m], heap_i[j]
+                    j = m
+        top_idx[i, :] = heap_i
+        top_val[i, :] = heap_v
+
+def channel_max_feat(feat_ts, feat_shape):
+    """Collapse CNN activation time courses into the max across channels at
+    each location.
+    `feat_ts` is a (channel*row*col, time) array, and `feat_shape` is a tuple
+    of (channel, row, col). Return a (row*col, time) array.
+
+    Note: correlation with the channel-max time course is not identical to
+    the max of the correlations with each channel, but the resulting
+    correlation matrix is #channel times smaller.
+    """
+    feat_ts = feat_ts.reshape(feat_shape[0], -1, feat_ts.shape[-1])
+    return feat_ts.max(axis=0)
+
+def top_n_pixels(corr_mtx, thresh, chnl_num, max_n, blk_size=256):
+    """Get the `max_n` most correlated pixels in the channel-max map of each
+    row of `corr_mtx`, ignoring values not larger than `thresh`.
+    `corr_mtx` is a (voxel, channel*pixel) array or memmap in float, or in
+    int8 with r quantized with a scale of 127. Return linear pixel indexes
+    and correlation values, each of shape (voxel, max_n).
+    """
+    top_idx = np.zeros((corr_mtx.shape[0], max_n), dtype=np.int64)
+    top_val = np.zeros((corr_mtx.shape[0], max_n), dtype=np.float32)
+    # the kernel scans raw int8 rows against the threshold in the quantized
+    # scale, which is kept as a float to select the same values as the
+    # dequantized matrix, and only the top values are dequantized
+    if corr_mtx.dtype == np.int8:
+        blk_thresh = thresh*127
+    else:
+        blk_thresh = thresh
+    # stream the memmap in row blocks rather than faulting in single rows
+    for b in range(0, corr_mtx.shape[0], blk_size):
+        blk = np.asarray(corr_mtx[b:b+blk_size])
+        if blk.dtype != np.int8:
+            blk = blk.astype(np.float32)
+        _retino_kernel(blk, blk_thresh, chnl_num, top_idx[b:b+blk_size],
+                       top_val[b:b+blk_size])
+    if corr_mtx.dtype == np.int8:
+        top_val *= 1 / 127.0
+    return top_idx, top_val
+
 def retinotopic_mapping(corr_file, data_dir, vxl_idx=None, figout=False):
-    """Make the retinotopic mapping using activation map from CNN."""
+    """Make the retinotopic mapping using activation map from CNN.
+    The cross-correlation matrix could be computed with the features of all
+    channels (96 x 27 x 27), or with channel-max features (27 x 27) derived
+    from `channel_max_feat`.
+    The matrix is best stored in float32 (or float16). A lossy int8 matrix is
+    accepted as well, but the estimated positions could move by a few pixels.
+    """
     if figout:
         fig_dir = os.path.join(data_dir, 'fig')
         check_path(fig_dir)
@@ -41,33 +128,31 @@ def retinotopic_mapping(corr_file, data_dir, vxl_idx=None, figout=False):
         return
     else:
         print 'voxel index loaded.'
+    # get indices of n maximum values in channel-max map of each voxel,
+    # using significant threshold for one-tail test
+    max_n = 20
+    thresh = 0.019257
+    chnl_num = corr_mtx.shape[1] / (27*27)
+    top_idx, top_val = top_n_pixels(corr_mtx, thresh, chnl_num, max_n)
+    # center of mass
+    val_sum = top_val.sum(axis=1)
+    sig_idx = np.nonzero(val_sum)[0]
+    # empty slots (index -1) have zero weight
+    row_idx, col_idx = np.unravel_index(np.maximum(top_idx[sig_idx], 0),
+                                        (27, 27))
     pos_mtx = np.zeros((73728, 2))
     pos_mtx[:] = np.nan
-    for i in range(len(vxl_idx)):
-        print 'Iter %s of %s' %(i+1, len(vxl_idx)),
-        tmp = corr_mtx[i, :]
-        tmp = np.nan_to_num(np.array(tmp))
-        # significant threshold for one-tail test
-        tmp[tmp <= 0.019257] = 0
-        if np.sum(tmp):
-            tmp = tmp.reshape(96, 27, 27)
-            mmtx = np.max(tmp, axis=0)
-            print mmtx.min(), mmtx.max()
-            # get indices of n maximum values
-            max_n = 20
-            row_idx, col_idx = np.unravel_index(
-                                        np.argsort(mmtx.ravel())[-1*max_n:],
-                                        mmtx.shape)
-            nmtx = np.zeros(mmtx.shape)
-            nmtx[row_idx, col_idx] = mmtx[row_idx, col_idx]
-            if figout:
-                fig_file = os.path.join(fig_dir, 'v'+str(vxl_idx[i])+'.png')
-                imsave(fig_file, nmtx)
-            # center of mass
-            x, y = ndimage.measurements.center_of_mass(nmtx)
-            pos_mtx[vxl_idx[i], :] = [x, y]
-        else:
-            print ' '
+    pos_mtx[vxl_idx[sig_idx], 0] = (top_val[sig_idx]*row_idx).sum(axis=1) / \
+                                   val_sum[sig_idx]
+    pos_mtx[vxl_idx[sig_idx], 1] = (top_val[sig_idx]*col_idx).sum(axis=1) / \
+                                   val_sum[sig_idx]
+    if figout:
+        for i in sig_idx:
+            nmtx = np.zeros(27*27)
+            used = top_idx[i] >= 0
+            nmtx[top_idx[i][used]] = top_val[i][used]
+            fig_file = os.path.join(fig_dir, 'v'+str(vxl_idx[i])+'.png')
+            imsave(fig_file, nmtx.reshape(27, 27))
     #receptive_field_file = os.path.join(data_dir, 'receptive_field_pos.npy')
     #np.save(receptive_field_file, pos_mtx)
     #pos_mtx = np.load(receptive_field_file)
@@ -79,20 +164,8 @@ def retinotopic_mapping(corr_file, data_dir, vxl_idx=None, figout=False):
     # 8-12 degree -> d < 16.5
     # 12-16 degree -> d < 22
     # else > 16 degree
-    ecc = np.zeros(dist.shape)
-    for i in range(len(dist)):
-        if np.isnan(dist[i]):
-            ecc[i] = np.nan
-        elif dist[i] < 2.7:
-            ecc[i] = 1
-        elif dist[i] < 5.4:
-            ecc[i] = 2
-        elif dist[i] < 8.1:
-            ecc[i] = 3
-        elif dist[i] < 10.8:
-            ecc[i] = 4
-        else:
-            ecc[i] = 5
+    ecc = np.digitize(dist, [2.7, 5.4, 8.1, 10.8]) + 1.0
+    ecc[np.isnan(dist)] = np.nan
     #dist_vec = np.nan_to_num(ecc)
     #vol = dist_vec.reshape(18, 64, 64)
     vol = ecc.reshape(18, 64, 64)
@@ -119,17 +192,17 @@ def inter_subj_cca(db_dir):
         subj_dir = os.path.join(db_dir, 'v%s'%subj)
         tf = tables.open_file(os.path.join(subj_dir, 'VoxelResponses.mat'))
         # generate mask
-        train_fmri_ts = tf.get_node('/rt')[:]
-        fmri_s = train_fmri_ts.sum(axis=1)
-        non_nan_idx = np.nonzero(np.logical_not(np.isnan(fmri_s)))[0]
+        non_nan_idx = vutil.get_nonnan_idx(tf.get_node('/rt'))
         mask_file = os.path.join(subj_dir, '%s_mask.nii.gz'%(subj))
         mask = vutil.data_swap(mask_file).flatten()
         vxl_idx = np.nonzero(mask==1)[0]
         vxl_idx = np.intersect1d(vxl_idx, non_nan_idx)
         #-- load fmri response
         zscore = lambda d: (d-d.mean(1, keepdims=True))/d.std(1, keepdims=True)
-        train_ts = np.nan_to_num(zscore(np.nan_to_num(tf.get_node('/rt')[:])))
-        val_ts = np.nan_to_num(zscore(np.nan_to_num(tf.get_node('/rv')[:])))
+        train_ts = np.nan_to_num(tf.get_node('/rt')[:], copy=False)
+        train_ts = np.nan_to_num(zscore(train_ts), copy=False)
+        val_ts = np.nan_to_num(tf.get_node('/rv')[:], copy=False)
+        val_ts = np.nan_to_num(zscore(val_ts), copy=False)
         # data.shape = (73728, 540/7200)
         print train_ts[vxl_idx].T.shape
         print val_ts[vxl_idx].T.shape
@@ -157,26 +230,27 @@ def ridge_retinotopic_mapping(corr_file, vxl_idx=None, top_n=None):
         top_n = 20
     pos_mtx = np.zeros((73728, 2))
     pos_mtx[:] = np.nan
-    for i in range(len(vxl_idx)):
-        print 'Iter %s of %s' %(i, len(vxl_idx)),
-        tmp = corr_mtx[:, i]
-        tmp = np.nan_to_num(np.array(tmp))
-        # significant threshold
-        # one-tail test
-        #tmp[tmp <= 0.17419] = 0
-        if np.sum(tmp):
-            tmp = tmp.reshape(55, 55)
-            print tmp.min(), tmp.max()
-            # get indices of n maximum values
-            row, col = np.unravel_index(np.argsort(tmp.ravel())[-1*top_n:],
-                                        tmp.shape)
-            mtx = np.zeros(tmp.shape)
-            mtx[row, col] = tmp[row, col]
-            # center of mass
-            x, y = ndimage.measurements.center_of_mass(mtx)
-            pos_mtx[vxl_idx[i], :] = [x, y]
-        else:
-            print ' '
+    blk_size = 1024
+    for b in range(0, len(vxl_idx), blk_size):
+        print 'Iter %s of %s' %(b, len(vxl_idx))
+        # read a block of voxel columns and convert it to float32 once
+        blk = np.asarray(corr_mtx[:, b:b+blk_size], dtype=np.float32)
+        blk = np.nan_to_num(blk)
+        for j in range(blk.shape[1]):
+            tmp = blk[:, j]
+            # significant threshold
+            # one-tail test
+            #tmp[tmp <= 0.17419] = 0
+            if np.sum(tmp):
+                tmp = tmp.reshape(55, 55)
+                # get indices of n maximum values
+                top_idx = np.argpartition(tmp.ravel(), -1*top_n)[-1*top_n:]
+                row, col = np.unravel_index(top_idx, tmp.shape)
+                mtx = np.zeros(tmp.shape)
+                mtx[row, col] = tmp[row, col]
+                # center of mass
+                x, y = ndimage.measurements.center_of_mass(mtx)
+                pos_mtx[vxl_idx[b+j], :] = [x, y]
     #receptive_field_file = os.path.join(data_dir, 'receptive_field_pos.npy')
     #np.save(receptive_field_file, pos_mtx)
     #pos_mtx = np.load(receptive_field_file)
@@ -188,20 +262,8 @@ def ridge_retinotopic_mapping(corr_file, vxl_idx=None, top_n=None):
     # 8-12 degree -> d < 16.5
     # 12-16 degree -> d < 22
     # else > 16 degree
-    ecc = np.zeros(dist.shape)
-    for i in range(len(dist)):
-        if np.isnan(dist[i]):
-            ecc[i] = np.nan
-        elif dist[i] < 5.445:
-            ecc[i] = 1
-        elif dist[i] < 10.91:
-            ecc[i] = 2
-        elif dist[i] < 16.39:
-            ecc[i] = 3
-        elif dist[i] < 21.92:
-            ecc[i] = 4
-        else:
-            ecc[i] = 5
+    ecc = np.digitize(dist, [5.445, 10.91, 16.39, 21.92]) + 1.0
+    ecc[np.isnan(dist)] = np.nan
     vol = ecc.reshape(18, 64, 64)
     vutil.save2nifti(vol, os.path.join(data_dir, 'ecc_max%s.nii.gz'%(top_n)))
     # angle
@@ -230,17 +292,26 @@ def hrf_estimate(tf, feat_ts):
     #lv1_roi = tf.get_node('/roi/v1lh')
     # get time courses for each voxel
     vxl_idx = [vutil.coord2idx(coord) for coord in voxels]
-    rt = tf.get_node('/rt')[:]
-    vxl_data = rt[vxl_idx, :]
-    vxl_data = np.nan_to_num(vxl_data)
-
-    out = np.zeros((290400, 40, 5))
+    vxl_data = np.array([tf.get_node('/rt')[idx] for idx in vxl_idx])
+    vxl_data = np.nan_to_num(vxl_data, copy=False)
+
+    # z-score feature time courses once for all voxels
+    feat_m = feat_ts.mean(axis=1, keepdims=True)
+    feat_s = feat_ts.std(axis=1, keepdims=True)
+    norm_feat_ts = ((feat_ts - feat_m) / feat_s).astype(np.float32)
+    # time-lagged correlation c[k] = sum_n x[n]*y[n+k] / T equals the full
+    # convolution of x and the reversed y at index T-1-k, which is computed
+    # with FFT for a block of features at once
+    T = feat_ts.shape[1]
+    maxlag = 40
+    blk_size = 4096
+    out = np.zeros((290400, maxlag, 5))
     for i in range(5):
-        for j in range(feat_ts.shape[0]):
-            print '%s - %s' %(i, j)
-            tmp = feat_ts[j, :]
-            tmp = (tmp - tmp.mean()) / tmp.std()
-            out[j, :, i] = time_lag_corr(tmp, vxl_data[i, :], 40)
+        print 'voxel %s' %(i)
+        rev_vxl = vxl_data[i, ::-1][None, :]
+        for b in range(0, feat_ts.shape[0], blk_size):
+            full = fftconvolve(norm_feat_ts[b:b+blk_size], rev_vxl, axes=1)
+            out[b:b+blk_size, :, i] = full[:, T-maxlag:T][:, ::-1] / T
     np.save('hrf_test.npy', out)
 
 def pls_y_pred_x(plsca, Y):
@@ -285,7 +356,6 @@ def plscorr_eval(train_fmri_ts, train_feat_ts, val_fmri_ts, val_feat_ts,
     plsca.fit(train_feat_ts, train_fmri_ts)
     from sklearn.externals import joblib
     joblib.dump(plsca, os.path.join(out_dir, 'plsca_model.pkl'))
-    plsca = joblib.load(os.path.join(out_dir, 'plsca_model.pkl'))
 
     # calculate correlation coefficient between truth and prediction
     pred_fmri_ts = plsca.predict(val_feat_ts)
@@ -342,7 +412,7 @@ def plscorr_viz(cca_dir, mask_file):
     #feat_cc = np.load(os.path.join(out_dir, 'feat_cc.npy'))
     #parallel_corr2_coef(train_feat_ts.T, feat_cc.T, 
     #                    os.path.join(out_dir, 'feat_cc_corr.npy'),
-    #                    block_size=10, n_jobs=1)
+    #                    block_size=10)
     #feat_cc_corr = np.load(os.path.join(out_dir, 'feat_cc_corr.npy'))
     #feat_cc_corr = feat_cc_corr.reshape(96, 11, 11, 10)
     #vutil.plot_cca_fweights(feat_cc_corr, out_dir, 'feat_cc_corr')
@@ -350,7 +420,7 @@ def plscorr_viz(cca_dir, mask_file):
     #fmri_cc = np.load(os.path.join(out_dir, 'fmri_cc.npy'))
     #parallel_corr2_coef(train_fmri_ts.T, fmri_cc.T,
     #                    os.path.join(out_dir, 'fmri_cc_corr.npy'),
-    #                    block_size=10, n_jobs=1)
+    #                    block_size=10)
     #fmri_cc_corr = np.load(os.path.join(out_dir, 'fmri_cc_corr.npy'))
     #vutil.save_cca_volweights(fmri_cc_corr, mask_file, out_dir,
     #                          prefix_name='fmri_cc_corr')
@@ -431,10 +501,8 @@ def reg_cca(train_fmri_ts, train_feat_ts, val_fmri_ts, val_feat_ts, out_dir):
     vutil.save_cca_volweights(fmri_weights, mask_file, out_dir, 'cca_component')
 
     feat_cc = cca.comps[0]
-    parallel_corr2_coef(train_feat_ts.T, feat_cc.T, 
-                        os.path.join(out_dir, 'feat_cc_corr.npy'),
-                        block_size=7, n_jobs=1)
-    feat_cc_corr = np.load(os.path.join(out_dir, 'feat_cc_corr.npy'))
+    feat_cc_corr = np.nan_to_num(corr2_coef(train_feat_ts.T, feat_cc.T))
+    np.save(os.path.join(out_dir, 'feat_cc_corr.npy'), feat_cc_corr)
     feat_cc_corr = feat_cc_corr.reshape(96, 11, 11, 7)
     vutil.plot_cca_fweights(feat_cc_corr, out_dir, 'feat_cc_corr')
 
@@ -532,11 +600,9 @@ if __name__ == '__main__':
     #vutil.gen_mean_vol(tf, dataset, mean_file)
 
     #-- create mask
-    train_fmri_ts = tf.get_node('/rt')[:]
     # data.shape = (73728, 7200)
     # get non-nan voxel indexs
-    fmri_s = train_fmri_ts.sum(axis=1)
-    non_nan_idx = np.nonzero(np.logical_not(np.isnan(fmri_s)))[0]
+    non_nan_idx = vutil.get_nonnan_idx(tf.get_node('/rt'))
     # create mask
     full_mask_file = os.path.join(subj_dir, 'S%s_mask.nii.gz'%(subj_id))
     full_mask = vutil.data_swap(full_mask_file).flatten()
@@ -553,10 +619,10 @@ if __name__ == '__main__':
         vxl_idx = full_vxl_idx
 
     #-- load fmri response
-    train_fmri_ts = tf.get_node('/rt')[:]
+    train_fmri_ts = vutil.get_node_rows(tf.get_node('/rt'), vxl_idx)
     #val_fmri_ts = tf.get_node('/rv')[:]
     # data.shape = (73728, 540/7200)
-    train_fmri_ts = np.nan_to_num(train_fmri_ts[vxl_idx])
+    train_fmri_ts = np.nan_to_num(train_fmri_ts, copy=False)
     #val_fmri_ts = np.nan_to_num(val_fmri_ts[vxl_idx])
     # data.shape = (994, 7200/540)
     ##-- save masked data as npy file
@@ -618,7 +684,16 @@ if __name__ == '__main__':
     # features from CNN
     #corr_file = os.path.join(cross_corr_dir, 'train_norm1_corr.npy')
     #feat_ts = train_feat_ts.reshape(69984, 7200)
-    #parallel_corr2_coef(train_fmri_ts, feat_ts, corr_file, block_size=96)
+    #parallel_corr2_coef(train_fmri_ts, feat_ts, corr_file)
+    # int8 storage halves the file size, but is lossy: quantizing r in steps
+    # of 1/127 moves the top-n center of mass of some voxels by several
+    # pixels, so use it only for a quick look
+    #parallel_corr2_coef(train_fmri_ts, feat_ts, corr_file, dtype='int8')
+    # features from CNN, max across channels
+    #corr_file = os.path.join(cross_corr_dir, 'train_norm1_max_corr.npy')
+    #feat_ts = channel_max_feat(train_feat_ts.reshape(69984, 7200),
+    #                           (96, 27, 27))
+    #parallel_corr2_coef(train_fmri_ts, feat_ts, corr_file)
     # features from optical flow
     #corr_file = os.path.join(cross_corr_dir, 'train_optic_mag_corr.npy')
     #feat_ts = tr_mag_ts.reshape(16384, 7200)
@@ -7,12 +7,13 @@ import numpy as np
 import tables
 from scipy import ndimage
 from scipy.misc import imsave
+from scipy.signal import fftconvolve
 import scipy.optimize as opt
 from sklearn.cross_decomposition import PLSCanonical
 from sklearn.linear_model import LassoCV
 
 from braincode.util import configParser
-from braincode.math import parallel_corr2_coef, corr2_coef, ridge
+from braincode.math import corr2_coef, ridge
 from braincode.math import get_pls_components, rcca
 from braincode.math import LinearRegression
 from braincode.math.norm import zero_one_norm, zscore
@@ -45,31 +46,28 @@ def retinotopic_mapping(corr_file, data_dir, vxl_idx=None, figout=False):
     pos_mtx = np.zeros((73728, 2))
     pos_mtx[:] = np.nan
     for i in range(len(vxl_idx)):
-        print 'Iter %s of %s' %(i+1, len(vxl_idx)),
-        tmp = corr_mtx[i, :]
-        tmp = np.nan_to_num(np.array(tmp))
+        if not i % 1024:
+            print 'Iter %s of %s' %(i+1, len(vxl_idx))
+        # single explicit conversion of the float16 row to float32
+        tmp = np.nan_to_num(np.asarray(corr_mtx[i, :], dtype=np.float32))
         # significant threshold for one-tail test
         tmp[tmp <= 0.019257] = 0
         if np.sum(tmp):
             mmtx = tmp.reshape(55, 55)
             #tmp = tmp.reshape(96, 27, 27)
             #mmtx = np.max(tmp, axis=0)
-            print mmtx.min(), mmtx.max()
             if figout:
                 fig_file = os.path.join(fig_dir, 'v'+str(vxl_idx[i])+'.png')
                 imsave(fig_file, mmtx)
             # get indices of n maximum values
             max_n = 20
-            row_idx, col_idx = np.unravel_index(
-                                        np.argsort(mmtx.ravel())[-1*max_n:],
-                                        mmtx.shape)
+            top_idx = np.argpartition(mmtx.ravel(), -1*max_n)[-1*max_n:]
+            row_idx, col_idx = np.unravel_index(top_idx, mmtx.shape)
             nmtx = np.zeros(mmtx.shape)
             nmtx[row_idx, col_idx] = mmtx[row_idx, col_idx]
             # center of mass
             x, y = ndimage.measurements.center_of_mass(nmtx)
             pos_mtx[vxl_idx[i], :] = [x, y]
-        else:
-            print ' '
     #receptive_field_file = os.path.join(data_dir, 'receptive_field_pos.npy')
     #np.save(receptive_field_file, pos_mtx)
     #pos_mtx = np.load(receptive_field_file)
@@ -150,17 +148,26 @@ def hrf_estimate(tf, feat_ts):
     #lv1_roi = tf.get_node('/roi/v1lh')
     # get time courses for each voxel
     vxl_idx = [vutil.coord2idx(coord) for coord in voxels]
-    rt = tf.get_node('/rt')[:]
-    vxl_data = rt[vxl_idx, :]
-    vxl_data = np.nan_to_num(vxl_data)
-
-    out = np.zeros((290400, 40, 5))
+    vxl_data = np.array([tf.get_node('/rt')[idx] for idx in vxl_idx])
+    vxl_data = np.nan_to_num(vxl_data, copy=False)
+
+    # z-score feature time courses once for all voxels
+    feat_m = feat_ts.mean(axis=1, keepdims=True)
+    feat_s = feat_ts.std(axis=1, keepdims=True)
+    norm_feat_ts = ((feat_ts - feat_m) / feat_s).astype(np.float32)
+    # time-lagged correlation c[k] = sum_n x[n]*y[n+k] / T equals the full
+    # convolution of x and the reversed y at index T-1-k, which is computed
+    # with FFT for a block of features at once
+    T = feat_ts.shape[1]
+    maxlag = 40
+    blk_size = 4096
+    out = np.zeros((290400, maxlag, 5))
     for i in range(5):
-        for j in range(feat_ts.shape[0]):
-            print '%s - %s' %(i, j)
-            tmp = feat_ts[j, :]
-            tmp = (tmp - tmp.mean()) / tmp.std()
-            out[j, :, i] = time_lag_corr(tmp, vxl_data[i, :], 40)
+        print 'voxel %s' %(i)
+        rev_vxl = vxl_data[i, ::-1][None, :]
+        for b in range(0, feat_ts.shape[0], blk_size):
+            full = fftconvolve(norm_feat_ts[b:b+blk_size], rev_vxl, axes=1)
+            out[b:b+blk_size, :, i] = full[:, T-maxlag:T][:, ::-1] / T
     np.save('hrf_test.npy', out)
 
 def pls_y_pred_x(plsca, Y):
@@ -205,7 +212,6 @@ def plscorr_eval(train_fmri_ts, train_feat_ts, val_fmri_ts, val_feat_ts,
     plsca.fit(train_feat_ts, train_fmri_ts)
     from sklearn.externals import joblib
     joblib.dump(plsca, os.path.join(out_dir, 'plsca_model.pkl'))
-    plsca = joblib.load(os.path.join(out_dir, 'plsca_model.pkl'))
 
     # calculate correlation coefficient between truth and prediction
     pred_fmri_ts = plsca.predict(val_feat_ts)
@@ -262,7 +268,7 @@ def plscorr_viz(cca_dir, mask_file):
     #feat_cc = np.load(os.path.join(out_dir, 'feat_cc.npy'))
     #parallel_corr2_coef(train_feat_ts.T, feat_cc.T, 
     #                    os.path.join(out_dir, 'feat_cc_corr.npy'),
-    #                    block_size=10, n_jobs=1)
+    #                    block_size=10)
     #feat_cc_corr = np.load(os.path.join(out_dir, 'feat_cc_corr.npy'))
     #feat_cc_corr = feat_cc_corr.reshape(96, 11, 11, 10)
     #vutil.plot_cca_fweights(feat_cc_corr, out_dir, 'feat_cc_corr')
@@ -270,7 +276,7 @@ def plscorr_viz(cca_dir, mask_file):
     #fmri_cc = np.load(os.path.join(out_dir, 'fmri_cc.npy'))
     #parallel_corr2_coef(train_fmri_ts.T, fmri_cc.T,
     #                    os.path.join(out_dir, 'fmri_cc_corr.npy'),
-    #                    block_size=10, n_jobs=1)
+    #                    block_size=10)
     #fmri_cc_corr = np.load(os.path.join(out_dir, 'fmri_cc_corr.npy'))
     #vutil.save_cca_volweights(fmri_cc_corr, mask_file, out_dir,
     #                          prefix_name='fmri_cc_corr')
@@ -351,10 +357,8 @@ def reg_cca(train_fmri_ts, train_feat_ts, val_fmri_ts, val_feat_ts, out_dir):
     vutil.save_cca_volweights(fmri_weights, mask_file, out_dir, 'cca_component')
 
     feat_cc = cca.comps[0]
-    parallel_corr2_coef(train_feat_ts.T, feat_cc.T, 
-                        os.path.join(out_dir, 'feat_cc_corr.npy'),
-                        block_size=7, n_jobs=1)
-    feat_cc_corr = np.load(os.path.join(out_dir, 'feat_cc_corr.npy'))
+    feat_cc_corr = np.nan_to_num(corr2_coef(train_feat_ts.T, feat_cc.T))
+    np.save(os.path.join(out_dir, 'feat_cc_corr.npy'), feat_cc_corr)
     feat_cc_corr = feat_cc_corr.reshape(96, 11, 11, 7)
     vutil.plot_cca_fweights(feat_cc_corr, out_dir, 'feat_cc_corr')
 
@@ -449,11 +453,9 @@ if __name__ == '__main__':
     #vutil.gen_mean_vol(tf, dataset, mean_file)
 
     #-- create mask
-    train_fmri_ts = tf.get_node('/rt')[:]
     # data.shape = (73728, 7200)
     # get non-nan voxel indexs
-    fmri_s = train_fmri_ts.sum(axis=1)
-    non_nan_idx = np.nonzero(np.logical_not(np.isnan(fmri_s)))[0]
+    non_nan_idx = vutil.get_nonnan_idx(tf.get_node('/rt'))
     if phrase=='test':
         lv1_mask = tf.get_node('/roi/v1lh')[:].flatten()
         vxl_idx = np.nonzero(lv1_mask==1)[0]
@@ -471,10 +473,10 @@ if __name__ == '__main__':
 
     #-- load fmri response
     # data shape: (#voxel, 7200/540)
-    train_fmri_ts = tf.get_node('/rt')[:]
-    train_fmri_ts = np.nan_to_num(train_fmri_ts[vxl_idx])
-    val_fmri_ts = tf.get_node('/rv')[:]
-    val_fmri_ts = np.nan_to_num(val_fmri_ts[vxl_idx])
+    train_fmri_ts = vutil.get_node_rows(tf.get_node('/rt'), vxl_idx)
+    train_fmri_ts = np.nan_to_num(train_fmri_ts, copy=False)
+    val_fmri_ts = vutil.get_node_rows(tf.get_node('/rv'), vxl_idx)
+    val_fmri_ts = np.nan_to_num(val_fmri_ts, copy=False)
     #-- save masked data as npy file
     #train_file = os.path.join(subj_dir, 'S%s_train_fmri_lV1.npy'%(subj_id))
     #val_file = os.path.join(subj_dir, 'S%s_val_fmri_lV1.npy'%(subj_id))
@@ -550,8 +552,7 @@ if __name__ == '__main__':
     #prf_feat_ts = gaussian_prfs.reshape(3025, 30250).T.dot(feat_ts)
     ## voxel~feat corr
     #corr_file = os.path.join(prf_dir, 'vxl_prf_corr.npy')
-    #parallel_corr2_coef(train_fmri_ts, prf_feat_ts, corr_file, block_size=550,
-    #                    n_jobs=2)
+    #parallel_corr2_coef(train_fmri_ts, prf_feat_ts, corr_file, block_size=550)
     #corr_mtx = np.load(corr_file, mmap_mode='r')
     ## parameter estimate
     #vxl_prf = np.zeros((len(vxl_idx), 3))
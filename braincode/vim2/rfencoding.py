@@ -44,31 +44,28 @@ def retinotopic_mapping(corr_file, data_dir, vxl_idx=None, figout=False):
     pos_mtx = np.zeros((73728, 2))
     pos_mtx[:] = np.nan
     for i in range(len(vxl_idx)):
-        print 'Iter %s of %s' %(i+1, len(vxl_idx)),
-        tmp = corr_mtx[i, :]
-        tmp = np.nan_to_num(np.array(tmp))
+        if not i % 1024:
+            print 'Iter %s of %s' %(i+1, len(vxl_idx))
+        # single explicit conversion of the float16 row to float32
+        tmp = np.nan_to_num(np.asarray(corr_mtx[i, :], dtype=np.float32))
         # significant threshold for one-tail test
         tmp[tmp <= 0.019257] = 0
         if np.sum(tmp):
             mmtx = tmp.reshape(55, 55)
             #tmp = tmp.reshape(96, 27, 27)
             #mmtx = np.max(tmp, axis=0)
-            print mmtx.min(), mmtx.max()
             if figout:
                 fig_file = os.path.join(fig_dir, 'v'+str(vxl_idx[i])+'.png')
                 imsave(fig_file, mmtx)
             # get indices of n maximum values
             max_n = 20
-            row_idx, col_idx = np.unravel_index(
-                                        np.argsort(mmtx.ravel())[-1*max_n:],
-                                        mmtx.shape)
+            top_idx = np.argpartition(mmtx.ravel(), -1*max_n)[-1*max_n:]
+            row_idx, col_idx = np.unravel_index(top_idx, mmtx.shape)
             nmtx = np.zeros(mmtx.shape)
             nmtx[row_idx, col_idx] = mmtx[row_idx, col_idx]
             # center of mass
             x, y = ndimage.measurements.center_of_mass(nmtx)
             pos_mtx[vxl_idx[i], :] = [x, y]
-        else:
-            print ' '
     #receptive_field_file = os.path.join(data_dir, 'receptive_field_pos.npy')
     #np.save(receptive_field_file, pos_mtx)
     #pos_mtx = np.load(receptive_field_file)
@@ -203,11 +200,9 @@ if __name__ == '__main__':
     #vutil.gen_mean_vol(tf, dataset, mean_file)
 
     #-- create mask
-    train_fmri_ts = tf.get_node('/rt')[:]
     # data.shape = (73728, 7200)
     # get non-nan voxel indexs
-    fmri_s = train_fmri_ts.sum(axis=1)
-    non_nan_idx = np.nonzero(np.logical_not(np.isnan(fmri_s)))[0]
+    non_nan_idx = vutil.get_nonnan_idx(tf.get_node('/rt'))
     if phrase=='test':
         lv1_mask = tf.get_node('/roi/v1lh')[:].flatten()
         vxl_idx = np.nonzero(lv1_mask==1)[0]
@@ -225,10 +220,10 @@ if __name__ == '__main__':
 
     #-- load fmri response
     # data shape: (#voxel, 7200/540)
-    train_fmri_ts = tf.get_node('/rt')[:]
-    train_fmri_ts = np.nan_to_num(train_fmri_ts[vxl_idx])
-    val_fmri_ts = tf.get_node('/rv')[:]
-    val_fmri_ts = np.nan_to_num(val_fmri_ts[vxl_idx])
+    train_fmri_ts = vutil.get_node_rows(tf.get_node('/rt'), vxl_idx)
+    train_fmri_ts = np.nan_to_num(train_fmri_ts, copy=False)
+    val_fmri_ts = vutil.get_node_rows(tf.get_node('/rv'), vxl_idx)
+    val_fmri_ts = np.nan_to_num(val_fmri_ts, copy=False)
     #-- save masked data as npy file
     #train_file = os.path.join(subj_dir, 'S%s_train_fmri_lV1.npy'%(subj_id))
     #val_file = os.path.join(subj_dir, 'S%s_val_fmri_lV1.npy'%(subj_id))
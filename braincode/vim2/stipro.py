@@ -5,6 +5,7 @@ import os
 import numpy as np
 import tables
 from scipy.misc import imsave
+from scipy.signal import fftconvolve
 import cv2
 from joblib import Parallel, delayed
 from skimage.color import rgb2gray
@@ -217,12 +218,11 @@ def stim_pro(feat_ptr, output, orig_size, fps, fact, sal_ts, i, using_hrf=True):
 
     # procssing
     bsize = orig_size[1]*orig_size[2]
+    # fill the time courses from each part into a pre-allocated buffer
+    offsets = np.cumsum([0] + [part.shape[0] for part in feat_ptr])
+    ts = np.empty((offsets[-1], bsize), dtype=feat_ptr[0].dtype)
     for p in range(len(feat_ptr)):
-        if not p:
-            ts = feat_ptr[p][:, i*bsize:(i+1)*bsize]
-        else:
-            ts = np.concatenate([ts, feat_ptr[p][:, i*bsize:(i+1)*bsize]],
-                                axis=0)
+        ts[offsets[p]:offsets[p+1]] = feat_ptr[p][:, i*bsize:(i+1)*bsize]
     ts = ts.T
     if sal_ts:
         ts = ts * sal_ts
@@ -230,13 +230,10 @@ def stim_pro(feat_ptr, output, orig_size, fps, fact, sal_ts, i, using_hrf=True):
     ts = np.log(ts+1)
     if using_hrf:
         # convolved with HRF
-        convolved = np.apply_along_axis(np.convolve, 1, ts, hrf_signal)
-        # remove time points after the end of the scanning run
-        n_to_remove = len(hrf_times) - 1
-        convolved = convolved[:, :-n_to_remove]
-        # temporal down-sample
-        vol_times = np.arange(0, ts.shape[1], fps)
-        ndts = convolved[:, vol_times]
+        convolved = fftconvolve(ts, hrf_signal[None, :], axes=1)
+        # remove time points after the end of the scanning run, and
+        # temporal down-sample with a strided view instead of fancy-indexing
+        ndts = convolved[:, :ts.shape[1]:fps]
     else:
         # temporal down-sample
         dts = down_sample(ts, (1, fps))
@@ -287,13 +284,10 @@ def feat_tr_pro(in_file, out_dir, out_dim=None, using_hrf=True):
     feat_ts = np.log(feat_ts+1)
     if using_hrf:
         # convolved with HRF
-        convolved = np.apply_along_axis(np.convolve, 1, feat_ts, hrf_signal)
-        # remove time points after the end of the scanning run
-        n_to_remove = len(hrf_times) - 1
-        convolved = convolved[:, :-n_to_remove]
-        # temporal down-sample
-        vol_times = np.arange(0, feat_ts.shape[1], fps)
-        dconvolved = convolved[:, vol_times]
+        convolved = fftconvolve(feat_ts, hrf_signal[None, :], axes=1)
+        # remove time points after the end of the scanning run, and
+        # temporal down-sample with a strided view instead of fancy-indexing
+        dconvolved = convolved[:, :feat_ts.shape[1]:fps]
     else:
         # temporal down-sample
         dts = down_sample(feat_ts, (1, fps))
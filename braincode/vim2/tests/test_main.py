@@ -0,0 +1,48 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+from numpy.testing import assert_array_equal, assert_allclose
+
+from braincode.vim2.main import top_n_pixels
+
+
+def test_top_n_pixels_int8():
+    """int8 and float matrices holding the same values select the same
+    voxels and pixels."""
+    rng = np.random.RandomState(0)
+    chnl_num = 4
+    # scale rows so that the max of some voxels stays around the threshold
+    scale = np.linspace(0.002, 0.01, 64)[:, None]
+    corr = np.clip(rng.randn(64, chnl_num*27*27)*scale, -1, 1)
+    corr[0] = 0
+    corr[0, 5] = 2 / 127.0
+    corr[1] = 0
+    corr[1, 5] = 3 / 127.0
+    q_mtx = np.clip(np.rint(corr*127), -127, 127).astype(np.int8)
+    f_mtx = q_mtx.astype(np.float32) / 127.0
+    q_idx, q_val = top_n_pixels(q_mtx, 0.019257, chnl_num, 20, blk_size=16)
+    f_idx, f_val = top_n_pixels(f_mtx, 0.019257, chnl_num, 20, blk_size=16)
+    q_sig = np.nonzero(q_val.sum(axis=1))[0]
+    f_sig = np.nonzero(f_val.sum(axis=1))[0]
+    assert_array_equal(q_sig, f_sig)
+    assert 0 not in q_sig
+    assert 1 in q_sig
+    assert 0 < len(q_sig) < 64
+    assert_array_equal(q_idx, f_idx)
+    assert_allclose(q_val, f_val, rtol=1e-6)
+
+def test_top_n_pixels_few_sig():
+    """Empty slots don't point at pixel 0 when fewer than `max_n` pixels pass
+    the threshold."""
+    corr = np.zeros((2, 2*27*27), dtype=np.float32)
+    corr[0, 0] = 0.5
+    corr[0, 27*27+3] = 0.3
+    corr[1, 10] = 0.01
+    top_idx, top_val = top_n_pixels(corr, 0.019257, 2, 20)
+    assert_array_equal(np.sort(top_idx[0][top_idx[0] >= 0]), [0, 3])
+    assert_array_equal((top_idx[0] >= 0).sum(), 2)
+    assert_allclose(top_val[0][top_idx[0] == 0], [0.5])
+    assert_allclose(top_val[0][top_idx[0] < 0], 0)
+    assert_array_equal(top_idx[1], -1)
+    assert_allclose(top_val[1], 0)
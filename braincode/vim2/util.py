@@ -335,18 +335,44 @@ def get_roi_mask(fmri_table, nifti=False):
     else:
         return mask.flatten()
 
+def node_nanmean(node, step=1024):
+    """Row-wise mean of a 2D array node (e.g. a pytables node) ignoring nan.
+    Data are read `step` rows at a time instead of being loaded into memory
+    as a whole; rows without any valid value are set to zero.
+    """
+    mean_data = np.zeros(node.shape[0])
+    for i in range(0, node.shape[0], step):
+        mean_data[i:i+step] = np.nan_to_num(np.nanmean(node[i:i+step], axis=1))
+    return mean_data
+
+def get_nonnan_idx(node, step=1024):
+    """Return index of rows without nan in a 2D array node (e.g. a pytables
+    node), reading `step` rows at a time.
+    """
+    mask = np.zeros(node.shape[0], dtype=bool)
+    for i in range(0, node.shape[0], step):
+        mask[i:i+step] = np.logical_not(np.isnan(node[i:i+step]).any(axis=1))
+    return np.nonzero(mask)[0]
+
+def get_node_rows(node, row_idx, step=1024):
+    """Read rows `row_idx` from a 2D array node (e.g. a pytables node),
+    `step` rows at a time, so that only the selected rows are kept in memory.
+    """
+    row_idx = np.asarray(row_idx)
+    data = np.zeros((len(row_idx), node.shape[1]), dtype=node.dtype)
+    for i in range(0, node.shape[0], step):
+        sel = np.nonzero((row_idx >= i) & (row_idx < i+step))[0]
+        if len(sel):
+            data[sel] = node[i:i+step][row_idx[sel]-i]
+    return data
+
 def gen_mean_vol(fmri_table, dataset, filename):
     """Make a mean response map as a reference volume."""
-    data = fmri_table.get_node('/'+dataset)[:]
-    # replace nan to zero
-    data = np.nan_to_num(data)
-    mean_data = np.mean(data, axis=1)
-    vol = np.zeros((18, 64, 64))
-    
-    for i in range(data.shape[0]):
-        c = vutil.idx2coord(i)
-        vol[c[0], c[1], c[2]] = mean_data[i]
-    
+    # ignore nan, voxels without any response are set to zero
+    mean_data = node_nanmean(fmri_table.get_node('/'+dataset))
+    # row index of the response matrix is the C-order index of the volume,
+    # as defined in `idx2coord`
+    vol = mean_data.reshape(18, 64, 64)
     save2nifti(vol, filename)
 
 def spatial_sim_seq(fmri_data):
@@ -381,18 +407,19 @@ def make_gaussian_prf(size):
 
 def sugar_gaussian_f(size, x0, y0, sigma, offset, beta):
     """Sugar function for model fitting."""
-    g = make_2d_gaussian(size, sigma, center=(y0, x0))
+    g = make_2d_gaussian(size, sigma, center=(y0, x0), dtype=np.float64)
     g = offset + beta * g
     return g.ravel()
 
 def sugar_dog_f(size, x0, y0, c_sigma, s_sigma, c_beta, s_beta):
     """Sugar function for model fitting."""
-    g = make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=(y0, x0))
+    g = make_2d_dog(size, c_sigma, s_sigma, c_beta, s_beta, center=(y0, x0),
+                    dtype=np.float64)
     return g.ravel()
 
 def sugar_log_f(size, x0, y0, sigma, offset, beta):
     """Sugar function for model fitting."""
-    g = make_2d_log(size, sigma, center=(y0, x0))
+    g = make_2d_log(size, sigma, center=(y0, x0), dtype=np.float64)
     g = offset + beta * g
     return g.ravel()
 